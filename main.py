@@ -3,27 +3,51 @@ import os
 import time
 import uuid
 import asyncio
+import functools
 import hashlib
+import hmac
+import importlib
+import random
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Hashable, Optional, Tuple
 from datetime import date
+from collections import OrderedDict
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-import pdfplumber
+import pypdfium2 as pdfium
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
-import json
+import jwt
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from core_pipeline import DocumentMetadata
 from processors.document_classifier import classify_document_type
-from langchain_community.document_loaders import PDFPlumberLoader, TextLoader, Docx2txtLoader
+from processors.extract_fields_basic import extract_fields_basic
+from processors.extract_fields_balanced import extract_fields_balanced
+from processors.vision_generate_markdown import vision_generate_markdown
+from langchain_community.document_loaders import PDFPlumberLoader, Docx2txtLoader
 from langchain_core.documents import Document
-from utils.supabase_schemas import get_schema_content, get_schema_details
+from utils.config import SUPABASE_URL, SUPABASE_ANON_KEY
+from utils.pdfium_lock import PDFIUM_LOCK
+from utils.supabase_schemas import get_schema_content, get_schema_details, delete_schema
+from utils.prompt_generator import (
+    calculate_prompt_cache_key,
+    delete_prompt_from_cache,
+    generate_system_prompt,
+    warm_up_prompt_generator,
+)
 
 # Initialize FastAPI app
-app = FastAPI(title="Document Processor API", version="1.0.0")
+app = FastAPI(title="Document Processor API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS Middleware
 app.add_middleware(
@@ -34,6 +58,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large extraction responses
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Response Models
 class ProcessResponse(BaseModel):
     status: str
@@ -73,31 +100,181 @@ class DeferredPersistenceRecord(BaseModel):
 
 MAX_PAGES_PER_BATCH = 20
 MAX_PAGES_PER_MONTH = 200
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 << 20)))
+UPLOAD_CHUNK_SIZE = 1 << 20
+# The router only needs the beginning of a document to classify it
+ROUTER_SAMPLE_CHARS = int(os.getenv("ROUTER_SAMPLE_CHARS", "4000"))
+# Set PDFIUM_TEXT=0 to load PDF text with PDFPlumberLoader again
+PDFIUM_TEXT = os.getenv("PDFIUM_TEXT", "1") != "0"
+
+# Supabase endpoints (settings come from utils.config)
+AUTH_USER_URL = f"{SUPABASE_URL}/auth/v1/user" if SUPABASE_URL else None
+PROFILES_URL = f"{SUPABASE_URL}/rest/v1/profiles" if SUPABASE_URL else None
+USAGE_RPC_URL = f"{SUPABASE_URL}/rest/v1/rpc/increment_usage_pages" if SUPABASE_URL else None
+DOCUMENTS_URL = f"{SUPABASE_URL}/rest/v1/documents" if SUPABASE_URL else None
+EXTRACTION_RESULTS_URL = f"{SUPABASE_URL}/rest/v1/extraction_results" if SUPABASE_URL else None
+# Statuses on which a non-idempotent Supabase write is known not to have been applied
+# (rate limited / PostgREST without a database connection). 502 and 504 are left out:
+# the gateway may have given up on an insert that still committed.
+SUPABASE_RETRY_STATUSES = {429, 503}
+SUPABASE_MAX_ATTEMPTS = 4
+# Optional: enables local verification of user access tokens (skips /auth/v1/user)
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+# Admin bearer token for /metrics; the route is disabled while unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# One keep-alive connection pool for all Supabase calls (they run in worker threads)
+# urllib3 only retries idempotent methods on these statuses (plus connect failures);
+# POST/PATCH callers decide for themselves, e.g. _insert_extraction_results.
+_SUPABASE_ADAPTER = HTTPAdapter(
+    pool_maxsize=int(os.getenv("SUPABASE_POOL", "32")),
+    max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504], raise_on_status=False),
+)
+_SUPABASE_HTTP = requests.Session()
+_SUPABASE_HTTP.mount("https://", _SUPABASE_ADAPTER)
+_SUPABASE_HTTP.mount("http://", _SUPABASE_ADAPTER)
+
+if not SUPABASE_URL or not SUPABASE_ANON_KEY:
+    print("[Config] VITE_SUPABASE_URL / VITE_SUPABASE_ANON_KEY not set; auth, quota and persistence are disabled")
 
 
 class _TTLCache:
-    def __init__(self, ttl_seconds: int):
+    """TTL cache bounded to `maxsize` entries, evicting the least recently used.
+
+    Shared by request handlers and worker threads, so every operation holds a lock.
+    With `stale_seconds`, entries stay readable through `get_or_stale` for that long
+    past their TTL so the caller can serve them while refreshing in the background.
+    """
+
+    # How long a stale entry is treated as fresh once a refresh has been handed out
+    REFRESH_GRACE_SECONDS = 30
+
+    def __init__(self, ttl_seconds: int, maxsize: int = 1024, stale_seconds: int = 0):
         self.ttl_seconds = ttl_seconds
-        self._store: Dict[str, Tuple[float, Any]] = {}
+        self.maxsize = maxsize
+        self.stale_seconds = stale_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        # key -> (expires_at, stale_until, value)
+        self._store: "OrderedDict[Hashable, Tuple[float, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value, _ = self.get_or_stale(key, allow_stale=False)
+        return value
 
-    def get(self, key: str) -> Optional[Any]:
-        item = self._store.get(key)
-        if not item:
-            return None
-        expires_at, value = item
-        if expires_at < time.time():
+    def get_or_stale(self, key: Hashable, allow_stale: bool = True) -> Tuple[Optional[Any], bool]:
+        """Return (value, needs_refresh).
+
+        needs_refresh is True for one caller per stale entry; everyone else keeps
+        getting the stale value until that refresh lands or the entry runs out.
+        """
+        now = time.time()
+        with self._lock:
+            item = self._store.get(key)
+            if item and now < item[0]:
+                self._store.move_to_end(key)
+                self.hits += 1
+                return item[2], False
+            if item and allow_stale and now < item[1]:
+                # Never push past stale_until, or failing refreshes would keep the entry forever
+                self._store[key] = (min(now + self.REFRESH_GRACE_SECONDS, item[1]), item[1], item[2])
+                self._store.move_to_end(key)
+                self.stale_hits += 1
+                return item[2], True
+            if item and now >= item[1]:
+                del self._store[key]
+            self.misses += 1
+            return None, False
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[int] = None) -> None:
+        # Entries with an explicit TTL (negative results) are never served stale
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        stale = self.stale_seconds if ttl_seconds is None else 0
+        now = time.time()
+        with self._lock:
+            self._store[key] = (now + ttl, now + ttl + stale, value)
+            self._store.move_to_end(key)
+            while len(self._store) > self.maxsize:
+                self._store.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
             self._store.pop(key, None)
-            return None
-        return value
 
-    def set(self, key: str, value: Any) -> None:
-        self._store[key] = (time.time() + self.ttl_seconds, value)
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._store),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+            }
+
 
+# Negative results (rejected token, user without profile) are cached briefly
+# so repeated calls don't hammer Supabase, but recover quickly once fixed.
+NEGATIVE_CACHE_TTL_SECONDS = 30
 
-_USER_BY_TOKEN_CACHE = _TTLCache(ttl_seconds=300)
-_TENANT_BY_USER_CACHE = _TTLCache(ttl_seconds=900)
-_SCHEMA_DETAILS_CACHE = _TTLCache(ttl_seconds=900)
+_USER_BY_TOKEN_CACHE = _TTLCache(ttl_seconds=300, maxsize=10_000)
+# Tenant membership and schema metadata change rarely, so expired entries are served
+# for a while longer and refreshed off the request path. The token cache is left
+# strict so a revoked token is not honoured past its TTL.
+_TENANT_BY_USER_CACHE = _TTLCache(ttl_seconds=900, maxsize=10_000, stale_seconds=900)
+_SCHEMA_DETAILS_CACHE = _TTLCache(ttl_seconds=900, stale_seconds=900)
 _SYSTEM_PROMPT_CACHE = _TTLCache(ttl_seconds=3600)
+_SCHEMA_CONTENT_CACHE = _TTLCache(ttl_seconds=60)
+_EXTRACTION_RESULT_CACHE = _TTLCache(ttl_seconds=3600)
+# id(schema) -> (schema, sha256); short TTL so per-request schema dicts don't linger.
+_SCHEMA_DIGEST_CACHE = _TTLCache(ttl_seconds=300, maxsize=128)
+
+_CACHES = {
+    "user_by_token": _USER_BY_TOKEN_CACHE,
+    "tenant_by_user": _TENANT_BY_USER_CACHE,
+    "schema_details": _SCHEMA_DETAILS_CACHE,
+    "system_prompt": _SYSTEM_PROMPT_CACHE,
+    "schema_content": _SCHEMA_CONTENT_CACHE,
+    "extraction_result": _EXTRACTION_RESULT_CACHE,
+    "schema_digest": _SCHEMA_DIGEST_CACHE,
+}
+
+# Per-key locks so concurrent misses for the same lookup hit Supabase (or the LLM) only once
+_SINGLE_FLIGHT_LOCKS: Dict[Hashable, threading.Lock] = {}
+_SINGLE_FLIGHT_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def _single_flight(key: Hashable):
+    with _SINGLE_FLIGHT_LOCKS_GUARD:
+        key_lock = _SINGLE_FLIGHT_LOCKS.setdefault(key, threading.Lock())
+    try:
+        with key_lock:
+            yield
+    finally:
+        with _SINGLE_FLIGHT_LOCKS_GUARD:
+            if _SINGLE_FLIGHT_LOCKS.get(key) is key_lock and not key_lock.locked():
+                del _SINGLE_FLIGHT_LOCKS[key]
+
+
+# Background refreshes for stale cache entries; small so a burst of expiries
+# cannot crowd out request work on the Supabase session.
+_CACHE_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+
+
+def _refresh_in_background(func, *args, **kwargs) -> None:
+    def _run() -> None:
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            print(f"[Cache] Background refresh via {func.__name__} failed: {e}")
+
+    try:
+        _CACHE_REFRESH_EXECUTOR.submit(_run)
+    except RuntimeError:
+        # Executor already shut down
+        pass
 
 
 def _determine_workflow(file_extension: str, content_length: int) -> str:
@@ -138,11 +315,28 @@ def _should_use_optimistic_path(schema_details: Optional[Dict[str, Any]], docume
 
 @contextmanager
 def _stage_timer(timings_ms: Dict[str, int], name: str):
-    start = time.time()
+    start = time.perf_counter()
     try:
         yield
     finally:
-        timings_ms[name] = int((time.time() - start) * 1000)
+        timings_ms[name] = int((time.perf_counter() - start) * 1000)
+
+
+async def _timed_stage(timings_ms: Dict[str, int], name: str, awaitable):
+    """Await `awaitable` under _stage_timer, so concurrent stages keep their own timings."""
+    with _stage_timer(timings_ms, name):
+        return await awaitable
+
+
+def _get_upload_size(file: UploadFile) -> int:
+    """Size of the upload in bytes, without reading it into memory."""
+    if getattr(file, "size", None) is not None:
+        return file.size
+    try:
+        file.file.seek(0, os.SEEK_END)
+        return file.file.tell()
+    finally:
+        file.file.seek(0)
 
 
 def _count_upload_pages(file: UploadFile) -> int:
@@ -153,9 +347,14 @@ def _count_upload_pages(file: UploadFile) -> int:
     suffix = Path(file.filename).suffix.lower()
     if suffix == ".pdf":
         try:
-            # pdfplumber can read from file-like objects; ensure we rewind afterwards.
-            with pdfplumber.open(file.file) as pdf:
-                return len(pdf.pages)
+            # PDFium reads the page count from the xref/page tree without parsing
+            # page content, straight from the spooled upload; rewind afterwards.
+            with PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(file.file)
+                try:
+                    return len(pdf)
+                finally:
+                    pdf.close()
         except Exception as e:
             raise HTTPException(
                 status_code=400,
@@ -175,13 +374,34 @@ def _count_upload_pages(file: UploadFile) -> int:
     return 1
 
 
-def _load_file_content(tmp_path: str, is_pdf: bool, is_txt: bool, is_docx: bool) -> tuple[str, int]:
+def _extract_pdf_text(tmp_path: str) -> tuple[str, int]:
+    """Extract plain text from a PDF with PDFium. Returns (text, page_count)."""
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(tmp_path)
+        try:
+            pages = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+            return "\n".join(pages), len(pages)
+        finally:
+            pdf.close()
+
+
+def _load_file_content(tmp_path: str, is_pdf: bool) -> tuple[str, int]:
     """Synchronous helper to load file content, to be run in a thread. Returns (text, page_count)."""
     try:
         if is_pdf:
+            if PDFIUM_TEXT:
+                try:
+                    text, page_count = _extract_pdf_text(tmp_path)
+                    if page_count:
+                        return text, page_count
+                except Exception as e:
+                    print(f"[Loader] PDFium text extraction failed, falling back to pdfplumber: {e}")
             loader = PDFPlumberLoader(tmp_path)
-        elif is_txt:
-            loader = TextLoader(tmp_path, encoding="utf-8")
         else:
             # docx
             loader = Docx2txtLoader(tmp_path)
@@ -190,7 +410,7 @@ def _load_file_content(tmp_path: str, is_pdf: bool, is_txt: bool, is_docx: bool)
         if not docs:
             raise ValueError("Could not extract text from document")
         
-        text = "\n".join([d.page_content for d in docs])
+        text = "\n".join(d.page_content for d in docs)
         page_count = len(docs)
         return text, page_count
     except Exception as e:
@@ -198,33 +418,73 @@ def _load_file_content(tmp_path: str, is_pdf: bool, is_txt: bool, is_docx: bool)
 
 
 
+def _decode_supabase_jwt(token: str) -> Optional[Dict[str, Any]]:
+    """Verify a Supabase access token locally and return its claims.
+
+    Returns None when SUPABASE_JWT_SECRET is not configured or the token does not
+    verify, so callers can fall back to the /auth/v1/user endpoint.
+    """
+    if not SUPABASE_JWT_SECRET:
+        return None
+    try:
+        claims = jwt.decode(
+            token,
+            SUPABASE_JWT_SECRET,
+            algorithms=["HS256"],
+            audience="authenticated",
+            options={"require": ["sub", "exp"]},
+        )
+    except jwt.PyJWTError:
+        return None
+    return claims if isinstance(claims, dict) else None
+
+
 def _get_user_id_from_token_cached(auth_header: Optional[str]) -> Optional[str]:
     if not auth_header or not auth_header.startswith("Bearer "):
         return None
+    token = auth_header[len("Bearer "):].strip()
+    if not token:
+        return None
 
-    cached = _USER_BY_TOKEN_CACHE.get(auth_header)
+    # Key on a short digest so raw tokens are not held in memory for the TTL.
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = _USER_BY_TOKEN_CACHE.get(cache_key)
     if isinstance(cached, dict):
         return cached.get("id")
 
+    with _single_flight(("user", cache_key)):
+        # Another request with the same token may have resolved it while we waited
+        cached = _USER_BY_TOKEN_CACHE.get(cache_key)
+        if isinstance(cached, dict):
+            return cached.get("id")
+        return _fetch_user_id_for_token(token, cache_key)
+
+
+def _fetch_user_id_for_token(token: str, cache_key: bytes) -> Optional[str]:
     try:
-        token = auth_header.split(" ")[1]
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
+        claims = _decode_supabase_jwt(token)
+        if claims:
+            user = {"id": claims["sub"], "email": claims.get("email")}
+            _USER_BY_TOKEN_CACHE.set(cache_key, user)
+            return user["id"]
 
-        if not supabase_url or not supabase_key:
+        if not SUPABASE_URL or not SUPABASE_ANON_KEY:
             return None
 
         headers = {
-            "apikey": supabase_key,
+            "apikey": SUPABASE_ANON_KEY,
             "Authorization": f"Bearer {token}",
         }
-        resp = requests.get(f"{supabase_url}/auth/v1/user", headers=headers, timeout=5)
+        resp = _SUPABASE_HTTP.get(AUTH_USER_URL, headers=headers, timeout=5)
+        if resp.status_code in (401, 403):
+            _USER_BY_TOKEN_CACHE.set(cache_key, {}, ttl_seconds=NEGATIVE_CACHE_TTL_SECONDS)
+            return None
         if resp.status_code != 200:
             return None
 
-        payload = resp.json() if resp.content else {}
+        payload = orjson.loads(resp.content) if resp.content else {}
         if isinstance(payload, dict) and payload.get("id"):
-            _USER_BY_TOKEN_CACHE.set(auth_header, payload)
+            _USER_BY_TOKEN_CACHE.set(cache_key, payload)
             return payload.get("id")
         return None
     except Exception:
@@ -235,73 +495,163 @@ def _get_tenant_id_for_user_cached(*, user_id: Optional[str], auth_header: Optio
     if not user_id:
         return None
 
-    cached = _TENANT_BY_USER_CACHE.get(user_id)
+    cached, needs_refresh = _TENANT_BY_USER_CACHE.get_or_stale(user_id)
     if isinstance(cached, str):
-        return cached
+        if needs_refresh:
+            _refresh_in_background(_fetch_tenant_id_for_user, user_id=user_id, auth_header=auth_header)
+        return cached or None
+
+    return _fetch_tenant_id_for_user(user_id=user_id, auth_header=auth_header)
+
 
+def _fetch_tenant_id_for_user(*, user_id: str, auth_header: Optional[str]) -> Optional[str]:
     if not auth_header or not auth_header.startswith("Bearer "):
         return None
 
     try:
         token = auth_header.split(" ")[1]
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
-
-        if not supabase_url or not supabase_key:
+        if not SUPABASE_URL or not SUPABASE_ANON_KEY:
             return None
 
         headers = {
-            "apikey": supabase_key,
+            "apikey": SUPABASE_ANON_KEY,
             "Authorization": f"Bearer {token}",
         }
 
-        profile_resp = requests.get(
-            f"{supabase_url}/rest/v1/profiles",
+        profile_resp = _SUPABASE_HTTP.get(
+            PROFILES_URL,
             headers={**headers, "Content-Type": "application/json"},
             params={"id": f"eq.{user_id}", "select": "tenant_id"},
             timeout=5,
         )
-        if profile_resp.status_code == 200 and profile_resp.json():
-            tenant_id = profile_resp.json()[0].get("tenant_id")
-            if tenant_id:
-                _TENANT_BY_USER_CACHE.set(user_id, tenant_id)
-            return tenant_id
-        return None
+        if profile_resp.status_code != 200:
+            return None
+        profiles = orjson.loads(profile_resp.content) if profile_resp.content else None
+        tenant_id = profiles[0].get("tenant_id") if profiles else None
+        if tenant_id:
+            _TENANT_BY_USER_CACHE.set(user_id, tenant_id)
+        else:
+            _TENANT_BY_USER_CACHE.set(user_id, "", ttl_seconds=NEGATIVE_CACHE_TTL_SECONDS)
+        return tenant_id
     except Exception:
         return None
 
 
-def _get_auth_context(auth_header: Optional[str]) -> tuple[Optional[str], Optional[str], Optional[str]]:
-    user_id = _get_user_id_from_token_cached(auth_header)
-    tenant_id = _get_tenant_id_for_user_cached(user_id=user_id, auth_header=auth_header)
+def _get_unverified_user_id(token: str) -> Optional[str]:
+    """Read the sub claim without verifying the token signature.
+
+    Only used to start the RLS-protected profile lookup early; the user id
+    handed to callers always comes from a verified source.
+    """
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError:
+        return None
+    return claims.get("sub") if isinstance(claims, dict) else None
+
+
+async def _get_auth_context(auth_header: Optional[str]) -> tuple[Optional[str], Optional[str], Optional[str]]:
     user_token = auth_header.split(" ")[1] if auth_header and auth_header.startswith("Bearer ") else None
+    user_id_hint = _get_unverified_user_id(user_token) if user_token else None
+
+    if user_id_hint:
+        # Resolve the user and the tenant concurrently; the tenant only counts
+        # if the verified user matches the token's claim.
+        user_id, tenant_id = await asyncio.gather(
+            asyncio.to_thread(_get_user_id_from_token_cached, auth_header),
+            asyncio.to_thread(_get_tenant_id_for_user_cached, user_id=user_id_hint, auth_header=auth_header),
+        )
+        if user_id != user_id_hint:
+            tenant_id = None
+        return user_id, tenant_id, user_token
+
+    user_id = await asyncio.to_thread(_get_user_id_from_token_cached, auth_header)
+    tenant_id = await asyncio.to_thread(_get_tenant_id_for_user_cached, user_id=user_id, auth_header=auth_header)
     return user_id, tenant_id, user_token
 
 
+def _schema_visible_to_tenant(details: Dict[str, Any], tenant_id: Optional[str]) -> bool:
+    """Same rule get_schema_details queries with: global templates or the tenant's own schemas."""
+    schema_tenant_id = details.get("tenant_id")
+    return schema_tenant_id is None or (tenant_id is not None and schema_tenant_id == tenant_id)
+
+
 def _get_schema_details_cached(schema_id: str, tenant_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    cached = _SCHEMA_DETAILS_CACHE.get(schema_id)
+    cached, needs_refresh = _SCHEMA_DETAILS_CACHE.get_or_stale(schema_id)
     if isinstance(cached, dict):
-        return cached
+        if needs_refresh:
+            _refresh_in_background(_fetch_schema_details, schema_id, tenant_id)
+        # Entries are shared across tenants, so re-apply the access check on every hit
+        return cached if _schema_visible_to_tenant(cached, tenant_id) else None
+
+    with _single_flight(("schema_details", schema_id)):
+        cached = _SCHEMA_DETAILS_CACHE.get(schema_id)
+        if isinstance(cached, dict):
+            return cached if _schema_visible_to_tenant(cached, tenant_id) else None
+        return _fetch_schema_details(schema_id, tenant_id)
+
+
+def _fetch_schema_details(schema_id: str, tenant_id: Optional[str]) -> Optional[Dict[str, Any]]:
     details = get_schema_details(schema_id, tenant_id)
     if isinstance(details, dict):
         _SCHEMA_DETAILS_CACHE.set(schema_id, details)
     return details
 
 
+def _get_schema_content_cached(schema_id: str) -> Dict[str, Any]:
+    cached = _SCHEMA_CONTENT_CACHE.get(schema_id)
+    if isinstance(cached, dict):
+        return cached
+    content = get_schema_content(schema_id)
+    # get_schema_content returns an empty field list on errors; don't cache that
+    if isinstance(content, dict) and content.get("fields"):
+        _SCHEMA_CONTENT_CACHE.set(schema_id, content)
+    return content
+
+
+def _schema_digest(schema: Any) -> str:
+    # Every file in a batch passes the same schema object, so memoise by identity.
+    # The entry keeps the schema alive, which stops its id() being reused.
+    memo = _SCHEMA_DIGEST_CACHE.get(id(schema))
+    if memo is not None and memo[0] is schema:
+        return memo[1]
+    try:
+        schema_json = orjson.dumps(schema, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        # e.g. non-string keys, which orjson refuses to serialize
+        schema_json = str(schema).encode("utf-8")
+    digest = hashlib.sha256(schema_json).hexdigest()
+    _SCHEMA_DIGEST_CACHE.set(id(schema), (schema, digest))
+    return digest
+
+
 def _calculate_system_prompt_cache_key(
     *,
     schema_id: Optional[str],
     document_type: str,
     schema: Any,
 ) -> str:
-    try:
-        schema_json = json.dumps(schema, sort_keys=True, ensure_ascii=False)
-    except Exception:
-        schema_json = str(schema)
-    digest = hashlib.sha256(schema_json.encode("utf-8")).hexdigest()
+    digest = _schema_digest(schema)
     return f"schema_id={schema_id or 'none'}|doc_type={document_type}|schema_sha256={digest}"
 
 
+def _calculate_extraction_cache_key(
+    *,
+    content_sha256: str,
+    tenant_id: Optional[str],
+    workflow: str,
+    schema_id: Optional[str],
+    document_type: str,
+    schema: Any,
+) -> str:
+    prompt_key = _calculate_system_prompt_cache_key(
+        schema_id=schema_id,
+        document_type=document_type,
+        schema=schema,
+    )
+    return f"content_sha256={content_sha256}|tenant={tenant_id or 'none'}|workflow={workflow}|{prompt_key}"
+
+
 def _get_system_prompt_cached(
     *,
     schema_id: Optional[str],
@@ -319,18 +669,40 @@ def _get_system_prompt_cached(
     if isinstance(cached, str) and cached:
         return cached
 
-    from utils.prompt_generator import generate_system_prompt
+    with _single_flight(("system_prompt", cache_key)):
+        # Another thread may have generated it while we waited
+        cached = _SYSTEM_PROMPT_CACHE.get(cache_key)
+        if isinstance(cached, str) and cached:
+            return cached
+
+        prompt = generate_system_prompt(
+            document_type=document_type,
+            schema=schema,
+            tenant_id=tenant_id,
+            schema_id=schema_id,
+            user_token=user_token,
+        )
+        if prompt:
+            _SYSTEM_PROMPT_CACHE.set(cache_key, prompt)
+        return prompt
+
 
-    prompt = generate_system_prompt(
+def _get_system_prompt_for_schema(
+    *,
+    schema_id: Optional[str],
+    document_type: str,
+    schema: Any,
+    tenant_id: Optional[str],
+    user_token: Optional[str],
+) -> str:
+    """Resolve the prompt-cache tenant for a schema, then return its system prompt."""
+    return _get_system_prompt_cached(
+        schema_id=schema_id,
         document_type=document_type,
         schema=schema,
-        tenant_id=tenant_id,
-        schema_id=schema_id,
+        tenant_id=_get_prompt_cache_tenant_id(schema_id=schema_id, tenant_id=tenant_id),
         user_token=user_token,
     )
-    if prompt:
-        _SYSTEM_PROMPT_CACHE.set(cache_key, prompt)
-    return prompt
 
 
 def _get_prompt_cache_tenant_id(*, schema_id: Optional[str], tenant_id: Optional[str]) -> Optional[str]:
@@ -338,7 +710,7 @@ def _get_prompt_cache_tenant_id(*, schema_id: Optional[str], tenant_id: Optional
         return tenant_id
 
     try:
-        details = get_schema_details(schema_id)
+        details = _get_schema_details_cached(schema_id, tenant_id)
         if not details:
             return tenant_id
 
@@ -370,16 +742,14 @@ def _adjust_monthly_usage_pages(
 
     Positive deltas are capped; negative deltas act as refunds.
     """
-    supabase_url = os.getenv("VITE_SUPABASE_URL")
-    supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
-    if not supabase_url or not supabase_key:
+    if not SUPABASE_URL or not SUPABASE_ANON_KEY:
         return True
 
     user_token = authorization.split(" ")[1] if authorization and authorization.startswith("Bearer ") else None
-    auth_token = user_token if user_token else supabase_key
+    auth_token = user_token if user_token else SUPABASE_ANON_KEY
 
     headers = {
-        "apikey": supabase_key,
+        "apikey": SUPABASE_ANON_KEY,
         "Authorization": f"Bearer {auth_token}",
         "Content-Type": "application/json",
     }
@@ -391,10 +761,10 @@ def _adjust_monthly_usage_pages(
         "p_max_pages": max_pages,
     }
 
-    resp = requests.post(
-        f"{supabase_url}/rest/v1/rpc/increment_usage_pages",
+    resp = _SUPABASE_HTTP.post(
+        USAGE_RPC_URL,
         headers=headers,
-        json=payload,
+        data=orjson.dumps(payload),
         timeout=5,
     )
 
@@ -402,14 +772,18 @@ def _adjust_monthly_usage_pages(
         # If quota infra isn't available yet, don't hard-fail processing.
         return True
 
+    # The RPC returns a scalar boolean, either as JSON or as plain text
+    body = resp.content.strip().strip(b'"').lower()
+    if body in (b"true", b"false"):
+        return body == b"true"
     try:
-        return bool(resp.json())
-    except Exception:
-        # Some PostgREST setups return "true"/"false" as text.
-        return resp.text.strip().lower() == "true"
+        return bool(orjson.loads(resp.content))
+    except orjson.JSONDecodeError:
+        return False
 
 
-def _log_extraction_result(
+def _build_extraction_result_row(
+    *,
     tenant_id: str,
     filename: str,
     document_id: Optional[str],
@@ -421,65 +795,141 @@ def _log_extraction_result(
     status: str = "completed",
     error_message: Optional[str] = None,
     batch_id: Optional[str] = None,
-    user_token: Optional[str] = None,
-) -> bool:
-    """Log extraction result to Supabase extraction_results table."""
+) -> Dict[str, Any]:
+    return {
+        "tenant_id": tenant_id,
+        "document_id": document_id,
+        "filename": filename,
+        "schema_id": schema_id if schema_id and schema_id not in ["inline-schema", "auto-schema"] else None,
+        "schema_name": schema_name,
+        "field_count": field_count,
+        "processing_duration_ms": processing_duration_ms,
+        "workflow": workflow,
+        "status": status,
+        "error_message": error_message,
+        "batch_id": batch_id,
+    }
+
+
+def _retry_delay_seconds(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Honor Retry-After when present, else exponential backoff with full jitter."""
+    if retry_after:
+        try:
+            return min(float(retry_after), 30.0)
+        except ValueError:
+            pass
+    return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+
+def _insert_extraction_results(rows: list[Dict[str, Any]], user_token: Optional[str] = None) -> bool:
+    """Insert extraction_results rows in a single request (PostgREST accepts array bodies)."""
     try:
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
-        
-        if not supabase_url or not supabase_key:
+        if not rows or not SUPABASE_URL or not SUPABASE_ANON_KEY:
             return False
         
         # Use user's token for RLS, fallback to anon key
-        auth_token = user_token if user_token else supabase_key
+        auth_token = user_token if user_token else SUPABASE_ANON_KEY
         
         headers = {
-            "apikey": supabase_key,
+            "apikey": SUPABASE_ANON_KEY,
             "Authorization": f"Bearer {auth_token}",
             "Content-Type": "application/json",
             "Prefer": "return=minimal",
         }
         
-        payload = {
-            "tenant_id": tenant_id,
-            "document_id": document_id,
-            "filename": filename,
-            "schema_id": schema_id if schema_id and schema_id not in ["inline-schema", "auto-schema"] else None,
-            "schema_name": schema_name,
-            "field_count": field_count,
-            "processing_duration_ms": processing_duration_ms,
-            "workflow": workflow,
-            "status": status,
-            "error_message": error_message,
-            "batch_id": batch_id,
-        }
-        
-        resp = requests.post(
-            f"{supabase_url}/rest/v1/extraction_results",
-            headers=headers,
-            json=payload,
-            timeout=5
-        )
-        return resp.status_code in [200, 201]
+        body = orjson.dumps(rows)
+        for attempt in range(SUPABASE_MAX_ATTEMPTS):
+            retry_after = None
+            try:
+                resp = _SUPABASE_HTTP.post(
+                    EXTRACTION_RESULTS_URL,
+                    headers=headers,
+                    data=body,
+                    timeout=5
+                )
+                if resp.status_code in [200, 201]:
+                    return True
+                if len(rows) > 1 and 400 <= resp.status_code < 500 and resp.status_code not in [401, 403, 429]:
+                    # Bulk inserts are atomic, so one bad row rejects them all: salvage row by row
+                    return all([_insert_extraction_results([row], user_token=user_token) for row in rows])
+                if resp.status_code not in SUPABASE_RETRY_STATUSES:
+                    return False
+                retry_after = resp.headers.get("Retry-After")
+            except requests.exceptions.ConnectTimeout:
+                # Never reached the server, so retrying cannot double-insert
+                pass
+            if attempt + 1 < SUPABASE_MAX_ATTEMPTS:
+                time.sleep(_retry_delay_seconds(attempt, retry_after))
+        print(f"[Persistence] Dropped {len(rows)} extraction_results row(s) after {SUPABASE_MAX_ATTEMPTS} attempts")
+        return False
     except Exception:
         return False
 
 
+def _log_extraction_result(
+    tenant_id: str,
+    filename: str,
+    document_id: Optional[str],
+    schema_id: Optional[str],
+    schema_name: Optional[str],
+    field_count: int,
+    processing_duration_ms: int,
+    workflow: str,
+    status: str = "completed",
+    error_message: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    user_token: Optional[str] = None,
+) -> bool:
+    """Log extraction result to Supabase extraction_results table."""
+    row = _build_extraction_result_row(
+        tenant_id=tenant_id,
+        filename=filename,
+        document_id=document_id,
+        schema_id=schema_id,
+        schema_name=schema_name,
+        field_count=field_count,
+        processing_duration_ms=processing_duration_ms,
+        workflow=workflow,
+        status=status,
+        error_message=error_message,
+        batch_id=batch_id,
+    )
+    return _insert_extraction_results([row], user_token=user_token)
+
+
+# Rows per bulk insert, so a very large batch doesn't become one oversized request
+PERSIST_CHUNK_ROWS = 500
+
+
 def _persist_deferred_records(records: list[DeferredPersistenceRecord]) -> None:
+    # Per token (RLS) and chunk: one bulk documents insert, whose ids go into the
+    # log rows, then one bulk extraction_results insert.
+    records_by_token: Dict[Optional[str], list[DeferredPersistenceRecord]] = {}
     for r in records:
-        try:
-            document_id = _create_document_row(
-                tenant_id=r.tenant_id,
-                filename=r.filename,
-                file_size=r.file_size,
-                page_count=r.page_count,
-                status=r.status,
-                metadata=r.metadata,
-                user_token=r.user_token,
-            )
-
-            _log_extraction_result(
+        records_by_token.setdefault(r.user_token, []).append(r)
+
+    chunks = [
+        (user_token, token_records[i:i + PERSIST_CHUNK_ROWS])
+        for user_token, token_records in records_by_token.items()
+        for i in range(0, len(token_records), PERSIST_CHUNK_ROWS)
+    ]
+    for user_token, token_records in chunks:
+        document_ids = _create_document_rows(
+            [
+                _build_document_row(
+                    tenant_id=r.tenant_id,
+                    filename=r.filename,
+                    file_size=r.file_size,
+                    page_count=r.page_count,
+                    status=r.status,
+                    metadata=r.metadata,
+                )
+                for r in token_records
+            ],
+            user_token=user_token,
+        )
+        rows = [
+            _build_extraction_result_row(
                 tenant_id=r.tenant_id,
                 filename=r.filename,
                 document_id=document_id,
@@ -491,13 +941,13 @@ def _persist_deferred_records(records: list[DeferredPersistenceRecord]) -> None:
                 status=r.status,
                 error_message=r.error_message,
                 batch_id=r.batch_id,
-                user_token=r.user_token,
             )
-        except Exception as e:
-            pass
+            for r, document_id in zip(token_records, document_ids)
+        ]
+        _insert_extraction_results(rows, user_token=user_token)
 
 
-def _create_document_row(
+def _build_document_row(
     *,
     tenant_id: str,
     filename: str,
@@ -505,51 +955,76 @@ def _create_document_row(
     page_count: Optional[int] = None,
     status: str,
     metadata: Optional[Dict[str, Any]] = None,
-    user_token: Optional[str] = None,
-) -> Optional[str]:
-    try:
-        import requests
+) -> Dict[str, Any]:
+    return {
+        "tenant_id": tenant_id,
+        "filename": filename,
+        "status": status,
+        "file_size": file_size,
+        "page_count": page_count,
+        "metadata": metadata or {},
+    }
 
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
-        if not supabase_url or not supabase_key:
-            return None
 
-        auth_token = user_token if user_token else supabase_key
+def _create_document_rows(rows: list[Dict[str, Any]], user_token: Optional[str] = None) -> list[Optional[str]]:
+    """Insert documents rows in a single request. Returns their ids in input order (None if unknown)."""
+    no_ids: list[Optional[str]] = [None] * len(rows)
+    try:
+        if not rows or not SUPABASE_URL or not SUPABASE_ANON_KEY:
+            return no_ids
+
+        auth_token = user_token if user_token else SUPABASE_ANON_KEY
 
         headers = {
-            "apikey": supabase_key,
+            "apikey": SUPABASE_ANON_KEY,
             "Authorization": f"Bearer {auth_token}",
             "Content-Type": "application/json",
             "Prefer": "return=representation",
         }
 
-        payload = {
-            "tenant_id": tenant_id,
-            "filename": filename,
-            "status": status,
-            "file_size": file_size,
-            "page_count": page_count,
-            "metadata": metadata or {},
-        }
-
-        resp = requests.post(
-            f"{supabase_url}/rest/v1/documents",
+        resp = _SUPABASE_HTTP.post(
+            DOCUMENTS_URL,
             headers=headers,
-            json=payload,
+            params={"select": "id"},
+            data=orjson.dumps(rows),
             timeout=5,
         )
         if resp.status_code not in [200, 201]:
-            return None
+            if len(rows) > 1 and 400 <= resp.status_code < 500 and resp.status_code not in [401, 403, 429]:
+                # Bulk inserts are atomic, so one bad row rejects them all: salvage row by row
+                return [_create_document_rows([row], user_token=user_token)[0] for row in rows]
+            return no_ids
 
-        data = resp.json()
-        if isinstance(data, list) and data:
-            return data[0].get("id")
+        # PostgREST returns inserted rows in the order they were sent
+        data = orjson.loads(resp.content)
         if isinstance(data, dict):
-            return data.get("id")
-        return None
+            data = [data]
+        if not isinstance(data, list) or len(data) != len(rows):
+            return no_ids
+        return [d.get("id") if isinstance(d, dict) else None for d in data]
     except Exception:
-        return None
+        return no_ids
+
+
+def _create_document_row(
+    *,
+    tenant_id: str,
+    filename: str,
+    file_size: Optional[int],
+    page_count: Optional[int] = None,
+    status: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    user_token: Optional[str] = None,
+) -> Optional[str]:
+    row = _build_document_row(
+        tenant_id=tenant_id,
+        filename=filename,
+        file_size=file_size,
+        page_count=page_count,
+        status=status,
+        metadata=metadata,
+    )
+    return _create_document_rows([row], user_token=user_token)[0]
 
 
 def _update_document_row(
@@ -561,17 +1036,13 @@ def _update_document_row(
     user_token: Optional[str] = None,
 ) -> bool:
     try:
-        import requests
-
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
-        if not supabase_url or not supabase_key:
+        if not SUPABASE_URL or not SUPABASE_ANON_KEY:
             return False
 
-        auth_token = user_token if user_token else supabase_key
+        auth_token = user_token if user_token else SUPABASE_ANON_KEY
 
         headers = {
-            "apikey": supabase_key,
+            "apikey": SUPABASE_ANON_KEY,
             "Authorization": f"Bearer {auth_token}",
             "Content-Type": "application/json",
             "Prefer": "return=minimal",
@@ -588,10 +1059,10 @@ def _update_document_row(
         if not payload:
             return True
 
-        resp = requests.patch(
-            f"{supabase_url}/rest/v1/documents?id=eq.{document_id}",
+        resp = _SUPABASE_HTTP.patch(
+            f"{DOCUMENTS_URL}?id=eq.{document_id}",
             headers=headers,
-            json=payload,
+            data=orjson.dumps(payload),
             timeout=5,
         )
         ok = resp.status_code in [200, 204]
@@ -600,10 +1071,67 @@ def _update_document_row(
         return False
 
 
+# Modules imported lazily on the first request (loader backends)
+_WARM_UP_MODULES = (
+    "docx2txt",
+)
+
+
+@app.on_event("startup")
+async def _warm_up_modules() -> None:
+    """Import heavy modules at startup so the first request doesn't pay for them."""
+    for module_name in _WARM_UP_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"[Startup] Warm-up import of '{module_name}' failed: {e}")
+
+    try:
+        warm_up_prompt_generator()
+    except Exception as e:
+        print(f"[Startup] Prompt generator warm-up failed: {e}")
+
+
+@app.on_event("startup")
+async def _install_io_executor() -> None:
+    """Size the default executor (asyncio.to_thread) for Supabase I/O and upload writes.
+
+    Python's default of min(32, cpu_count + 4) leaves 5-6 threads on small instances,
+    where a few slow Supabase calls would queue every other to_thread call behind them.
+    asyncio shuts it down (waiting for running calls) when the loop closes.
+    """
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=int(os.getenv("IO_POOL", "32")), thread_name_prefix="io")
+    )
+
+
+@app.on_event("shutdown")
+async def _shutdown_executors() -> None:
+    # Let in-flight logging/refund side effects finish before the pools and session go away
+    if _BACKGROUND_TASKS:
+        _, pending = await asyncio.wait(set(_BACKGROUND_TASKS), timeout=BACKGROUND_DRAIN_SECONDS)
+        if pending:
+            print(f"[Shutdown] {len(pending)} background task(s) still running after {BACKGROUND_DRAIN_SECONDS}s")
+    _EXTRACT_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    _CACHE_REFRESH_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    _SUPABASE_HTTP.close()
+
+
 @app.get("/")
 async def root():
     return {"message": "Document Processor API is running"}
 
+
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(None)):
+    """In-process cache sizes and hit/miss counters (per worker). Requires METRICS_TOKEN."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorization or not hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return {"caches": {name: cache.stats() for name, cache in _CACHES.items()}}
+
+
 @app.post("/process", response_model=ProcessResponse)
 async def process_document(
     file: UploadFile = File(...),
@@ -624,8 +1152,38 @@ async def process_document(
     )
     
 
-# Semaphore for batch processing concurrency control
-BATCH_SEMAPHORE = asyncio.Semaphore(5)
+# Semaphore for batch processing concurrency control. Files spend most of their
+# time waiting on LLM/vision APIs, so raise this as far as provider rate limits allow.
+BATCH_SEMAPHORE = asyncio.Semaphore(int(os.getenv("BATCH_CONCURRENCY", "5")))
+# Text loading is CPU-bound, so it gets its own CPU-sized bound inside the file slot
+LOADER_CONCURRENCY = int(os.getenv("LOADER_CONCURRENCY", str(os.cpu_count() or 4)))
+LOADER_SEMAPHORE = asyncio.Semaphore(LOADER_CONCURRENCY)
+
+# Dedicated pool for long-running router/vision/extraction calls, so they don't
+# starve the default executor used for Supabase I/O and upload writes.
+_EXTRACT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("EXTRACT_POOL", "32")),
+    thread_name_prefix="extract",
+)
+
+
+async def _run_extractor(func, /, *args, **kwargs):
+    """Run a blocking router/extractor call on the extraction pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXTRACT_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-flight
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+# How long shutdown waits for them (covers the Supabase insert retry budget)
+BACKGROUND_DRAIN_SECONDS = 30
+
+
+def _run_in_background(func, /, **kwargs) -> None:
+    """Run a blocking side effect (e.g. Supabase logging) in a thread without awaiting it."""
+    task = asyncio.create_task(asyncio.to_thread(func, **kwargs))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
 
 
 # Shared context for batch processing (leader-follower pattern)
@@ -633,17 +1191,44 @@ class BatchSharedContext:
     """Pre-computed context from leader document, shared with followers.
     
     Contains document type, schema, and system prompt that can be reused across files.
-    Workflow is determined per-file based on file extension.
+    Workflow is determined per-file based on file extension. The optimistic path may
+    supply system_prompt_task instead of system_prompt, which files await only when
+    they reach extraction.
     """
     def __init__(
         self,
         doc_type: str,
         schema_content: Dict[str, Any],
         system_prompt: Optional[str] = None,
+        system_prompt_task: Optional["asyncio.Task[str]"] = None,
     ):
+        # Followers never generate prompts themselves, so a context must carry one
+        if not system_prompt and system_prompt_task is None:
+            raise ValueError("BatchSharedContext requires system_prompt or system_prompt_task")
         self.doc_type = doc_type
         self.schema_content = schema_content
         self.system_prompt = system_prompt
+        self.system_prompt_task = system_prompt_task
+
+
+def _on_shared_prompt_done(task: "asyncio.Task[str]") -> None:
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Batch] Shared system prompt generation failed: {task.exception()}")
+
+
+def _on_schema_fetch_done(task: "asyncio.Task[Dict[str, Any]]") -> None:
+    # Retrieve the outcome even when the file returned before awaiting the fetch
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Batch] Schema fetch failed: {task.exception()}")
+
+
+def _start_shared_prompt(**kwargs) -> "asyncio.Task[str]":
+    """Generate the batch's system prompt in the background (see _get_system_prompt_for_schema)."""
+    task = asyncio.create_task(_run_extractor(_get_system_prompt_for_schema, **kwargs))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    task.add_done_callback(_on_shared_prompt_done)
+    return task
 
 
 async def _process_single_file(
@@ -652,7 +1237,7 @@ async def _process_single_file(
     authorization: Optional[str],
     shared_context: Optional[BatchSharedContext] = None,
     schema_id: Optional[str] = None,
-    schema_content_from_request: Optional[str] = None,
+    parsed_schema_from_request: Optional[Dict[str, Any]] = None,
     document_type: Optional[str] = None,
     is_leader: bool = False,
     defer_persistence: bool = False,
@@ -670,37 +1255,64 @@ async def _process_single_file(
     Leader document (is_leader=True): Determines doc_type, generates system_prompt, returns shared_context.
     Follower documents: Use pre-computed shared_context from leader.
     """
-    semaphore_wait_start = time.time()
+    semaphore_wait_start = time.perf_counter()
     await BATCH_SEMAPHORE.acquire()
-    semaphore_wait_ms = int((time.time() - semaphore_wait_start) * 1000)
+    semaphore_wait_ms = int((time.perf_counter() - semaphore_wait_start) * 1000)
     try:
-        start_time = time.time()
+        start_time = time.perf_counter()
         timings_ms: Dict[str, int] = {"semaphore_wait_ms": semaphore_wait_ms}
         request_id = f"{batch_id}:{file.filename}"
         if tenant_id is None or user_token is None:
-            _, tenant_id, user_token = _get_auth_context(authorization)
+            _, tenant_id, user_token = await _get_auth_context(authorization)
         
         suffix = Path(file.filename).suffix
         tmp_path = None
+        file_size: Optional[int] = None
         workflow_name = "unknown"
         document_row_id: Optional[str] = None
         deferred_record: Optional[DeferredPersistenceRecord] = None
+        schema_fetch_task: Optional[asyncio.Task] = None
         
         try:
-            # Save to temp file
+            # Check file extension
+            suffix_lower = suffix.lower()
+            is_pdf = suffix_lower == ".pdf"
+            is_txt = suffix_lower == ".txt"
+            is_docx = suffix_lower == ".docx"
+            is_image = suffix_lower in [".png", ".jpg", ".jpeg"]
+
+            if not (is_pdf or is_txt or is_docx or is_image):
+                return None, {"filename": file.filename, "error": f"Unsupported file type: {suffix}"}, None, None
+
+            if schema_id and not shared_context:
+                # The schema doesn't depend on the file: fetch it while the upload is spooled and parsed
+                schema_fetch_task = asyncio.create_task(asyncio.to_thread(_get_schema_content_cached, schema_id))
+                schema_fetch_task.add_done_callback(_on_schema_fetch_done)
+
             with _stage_timer(timings_ms, "upload_read_and_temp_write"):
-                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                if is_txt:
+                    # Plain text is decoded in memory; nothing downstream needs a path
                     content = await file.read()
-                    tmp.write(content)
-                    tmp_path = tmp.name
-
-            if tenant_id and tmp_path and not defer_persistence:
+                    file_size = len(content)
+                    content_hash = hashlib.sha256(content)
+                else:
+                    # Save to temp file
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                        tmp_path = tmp.name
+                        file_size = 0
+                        content_hash = hashlib.sha256()
+                        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                            await asyncio.to_thread(tmp.write, chunk)
+                            file_size += len(chunk)
+                            content_hash.update(chunk)
+
+            if tenant_id and not defer_persistence:
                 with _stage_timer(timings_ms, "supabase_document_create"):
                     document_row_id = await asyncio.to_thread(
                         _create_document_row,
                         tenant_id=tenant_id,
                         filename=file.filename,
-                        file_size=os.path.getsize(tmp_path),
+                        file_size=file_size,
                         page_count=None,
                         status="processing",
                         metadata={
@@ -711,23 +1323,27 @@ async def _process_single_file(
                         user_token=user_token,
                     )
             
-            # Check file extension
-            suffix_lower = suffix.lower()
-            is_pdf = suffix_lower == ".pdf"
-            is_txt = suffix_lower == ".txt"
-            is_docx = suffix_lower == ".docx"
-            is_image = suffix_lower in [".png", ".jpg", ".jpeg"]
-            
-            if is_pdf or is_txt or is_docx:
+            if is_txt:
                 try:
-                    with _stage_timer(timings_ms, "loader_text_extraction"):
-                        full_text, page_count = await asyncio.to_thread(
-                            _load_file_content,
-                            tmp_path,
-                            is_pdf,
-                            is_txt,
-                            is_docx,
-                        )
+                    full_text = content.decode("utf-8")
+                except UnicodeDecodeError as e:
+                    return None, {"filename": file.filename, "error": f"Failed to load document: {str(e)}"}, None, None
+                page_count = 1
+                router_doc = Document(page_content=full_text, metadata={"source": file.filename})
+
+            elif is_pdf or is_docx:
+                try:
+                    with _stage_timer(timings_ms, "loader_wait"):
+                        await LOADER_SEMAPHORE.acquire()
+                    try:
+                        with _stage_timer(timings_ms, "loader_text_extraction"):
+                            full_text, page_count = await asyncio.to_thread(
+                                _load_file_content,
+                                tmp_path,
+                                is_pdf,
+                            )
+                    finally:
+                        LOADER_SEMAPHORE.release()
                 except ValueError as e:
                      return None, {"filename": file.filename, "error": str(e)}, None, None
                 except Exception as e:
@@ -735,12 +1351,10 @@ async def _process_single_file(
 
                 router_doc = Document(page_content=full_text, metadata={"source": file.filename})
             
-            elif is_image:
+            else:
                 router_doc = Document(page_content="", metadata={"source": file.filename})
                 # images don't need text loading for router yet (vision step handles it)
                 page_count = 1
-            else:
-                return None, {"filename": file.filename, "error": f"Unsupported file type: {suffix}"}, None, None
             
             # Use shared context from leader, or compute for leader
             if shared_context:
@@ -748,44 +1362,51 @@ async def _process_single_file(
                 doc_type = shared_context.doc_type
                 schema_content = shared_context.schema_content
                 system_prompt = shared_context.system_prompt
+                pending_system_prompt = shared_context.system_prompt_task
 
             else:
-                # Leader or standalone: compute values
-                if is_image:
+                # Leader or standalone: compute values.
+                # An explicit document_type wins, so only route when it is missing.
+                if document_type:
+                    doc_type = document_type
+                elif is_image:
                     doc_type = "generic"
                 else:
                     with _stage_timer(timings_ms, "router"):
-                        doc_type = classify_document_type(router_doc, schema_id=schema_id, tenant_id=tenant_id)
-                
-                # Override with explicit document_type if provided
-                if document_type:
-                    doc_type = document_type
+                        doc_type = await _run_extractor(
+                            classify_document_type,
+                            Document(
+                                page_content=router_doc.page_content[:ROUTER_SAMPLE_CHARS],
+                                metadata=router_doc.metadata,
+                            ),
+                            schema_id=schema_id,
+                            tenant_id=tenant_id,
+                        )
                 
                 # Load schema
                 schema_content = None
-                if schema_id:
+                if schema_fetch_task:
+                    # Only the part of the fetch not hidden behind text extraction and routing
                     with _stage_timer(timings_ms, "schema_fetch"):
-                        schema_content = get_schema_content(schema_id)
+                        schema_content = await schema_fetch_task
                 
-                if not schema_content and schema_content_from_request:
-                    try:
-                        schema_content = json.loads(schema_content_from_request)
-                    except json.JSONDecodeError as e:
-                        return None, {"filename": file.filename, "error": f"Invalid schema JSON: {str(e)}"}, None, None
+                if not schema_content and parsed_schema_from_request:
+                    schema_content = parsed_schema_from_request
                 
                 if not schema_content:
                     return None, {"filename": file.filename, "error": "No schema provided"}, None, None
                 
                 # Generate system prompt for leader (followers will reuse)
                 system_prompt = None
+                pending_system_prompt = None
                 if is_leader:
-                    from utils.prompt_generator import generate_system_prompt
                     with _stage_timer(timings_ms, "prompt_generate"):
-                        system_prompt = generate_system_prompt(
+                        system_prompt = await _run_extractor(
+                            _get_system_prompt_for_schema,
+                            schema_id=schema_id,
                             document_type=doc_type,
                             schema=schema_content,
-                            tenant_id=_get_prompt_cache_tenant_id(schema_id=schema_id, tenant_id=tenant_id),
-                            schema_id=schema_id,
+                            tenant_id=tenant_id,
                             user_token=user_token,
                         )
             
@@ -793,50 +1414,73 @@ async def _process_single_file(
             workflow_name = _determine_workflow(suffix, len(full_text) if 'full_text' in locals() else 0)
             
             # Run extraction
-            from core_pipeline import DocumentMetadata
-            from processors.extract_fields_basic import extract_fields_basic
-            from processors.extract_fields_balanced import extract_fields_balanced
-            from processors.vision_generate_markdown import vision_generate_markdown
-            
             doc_metadata = DocumentMetadata(
                 document_number="api-batch",
                 filename=file.filename,
-                file_size=os.path.getsize(tmp_path),
+                file_size=file_size,
                 file_path=tmp_path,
                 processed_date=None
             )
             
             extraction_result = {}
+            # Set when vision came back without markdown, so fields were filled from nothing
+            vision_degraded = False
+            extraction_cache_key = _calculate_extraction_cache_key(
+                content_sha256=content_hash.hexdigest(),
+                tenant_id=tenant_id,
+                workflow=workflow_name,
+                schema_id=schema_id,
+                document_type=doc_type,
+                schema=schema_content,
+            )
+            cached_extraction = _EXTRACTION_RESULT_CACHE.get(extraction_cache_key)
             
-            if workflow_name == "balanced":
+            if isinstance(cached_extraction, dict):
+                # Same bytes already extracted with the same schema: skip vision/LLM calls
+                extraction_result = dict(cached_extraction)
+                timings_ms["extraction_cache_hit"] = 1
+            elif workflow_name == "balanced":
                 # Vision processing (unique per document)
-                with _stage_timer(timings_ms, "vision_generate_markdown"):
-                    vision_result = await asyncio.to_thread(
+                vision_stage = _timed_stage(
+                    timings_ms,
+                    "vision_generate_markdown",
+                    _run_extractor(
                         vision_generate_markdown,
                         document=router_doc,
                         metadata=doc_metadata,
                         schema_content=schema_content,
-                    )
-                vision_timings_ms = None
-                if isinstance(vision_result, dict):
-                    vision_timings_ms = vision_result.get("vision_timings_ms")
-                
-                # Use pre-computed prompt or generate if not available
-                if not system_prompt:
-                    with _stage_timer(timings_ms, "prompt_generate"):
-                        system_prompt = _get_system_prompt_cached(
+                    ),
+                )
+                if system_prompt:
+                    vision_result = await vision_stage
+                else:
+                    # No pre-computed prompt: generate (or wait for the batch's) while vision runs.
+                    # shield() keeps one file's cancellation from cancelling the shared task.
+                    if pending_system_prompt:
+                        prompt_stage = asyncio.shield(pending_system_prompt)
+                    else:
+                        prompt_stage = _run_extractor(
+                            _get_system_prompt_for_schema,
                             schema_id=schema_id,
                             document_type=doc_type,
                             schema=schema_content,
-                            tenant_id=_get_prompt_cache_tenant_id(schema_id=schema_id, tenant_id=tenant_id),
+                            tenant_id=tenant_id,
                             user_token=user_token,
                         )
+                    vision_result, system_prompt = await asyncio.gather(
+                        vision_stage,
+                        _timed_stage(timings_ms, "prompt_generate", prompt_stage),
+                    )
+                vision_timings_ms = None
+                if isinstance(vision_result, dict):
+                    vision_timings_ms = vision_result.get("vision_timings_ms")
                 
                 markdown_content = vision_result.get("markdown_content")
+                vision_degraded = not markdown_content
                 structure_hints = vision_result.get("structure_hints")
                 
                 with _stage_timer(timings_ms, "extract_fields_balanced"):
-                    extraction_result = await asyncio.to_thread(
+                    extraction_result = await _run_extractor(
                         extract_fields_balanced,
                         schema_content=schema_content,
                         system_prompt=system_prompt,
@@ -848,16 +1492,20 @@ async def _process_single_file(
                 # Use pre-computed prompt or generate if not available
                 if not system_prompt:
                     with _stage_timer(timings_ms, "prompt_generate"):
-                        system_prompt = _get_system_prompt_cached(
-                            schema_id=schema_id,
-                            document_type=doc_type,
-                            schema=schema_content,
-                            tenant_id=tenant_id,
-                            user_token=user_token,
-                        )
+                        if pending_system_prompt:
+                            system_prompt = await asyncio.shield(pending_system_prompt)
+                        else:
+                            system_prompt = await _run_extractor(
+                                _get_system_prompt_cached,
+                                schema_id=schema_id,
+                                document_type=doc_type,
+                                schema=schema_content,
+                                tenant_id=tenant_id,
+                                user_token=user_token,
+                            )
                 
                 with _stage_timer(timings_ms, "extract_fields_basic"):
-                    extraction_result = await asyncio.to_thread(
+                    extraction_result = await _run_extractor(
                         extract_fields_basic,
                         document=router_doc,
                         metadata=doc_metadata,
@@ -866,9 +1514,22 @@ async def _process_single_file(
                         system_prompt=system_prompt,
                     )
             
+            field_count = sum(1 for v in extraction_result.values() if v is not None) if extraction_result else 0
+
+            # Only replay clean runs: re-uploading after an empty, failed or degraded
+            # extraction should run it again, not return the same result for an hour
+            if (
+                not isinstance(cached_extraction, dict)
+                and field_count > 0
+                and not vision_degraded
+                and "error" not in extraction_result
+            ):
+                _EXTRACTION_RESULT_CACHE.set(extraction_cache_key, dict(extraction_result))
+
             # Build shared context for leader to return
+            # (no prompt means followers fall back to processing independently)
             result_shared_context = None
-            if is_leader:
+            if is_leader and system_prompt:
                 result_shared_context = BatchSharedContext(
                     doc_type=doc_type,
                     schema_content=schema_content,
@@ -877,8 +1538,7 @@ async def _process_single_file(
             
             
             # Log result
-            processing_duration_ms = int((time.time() - start_time) * 1000)
-            field_count = len([v for v in extraction_result.values() if v is not None]) if extraction_result else 0
+            processing_duration_ms = int((time.perf_counter() - start_time) * 1000)
             schema_name = schema_content.get("document_type") or schema_content.get("name") if schema_content else None
             
             if tenant_id:
@@ -886,7 +1546,7 @@ async def _process_single_file(
                     deferred_record = DeferredPersistenceRecord(
                         tenant_id=tenant_id,
                         filename=file.filename,
-                        file_size=os.path.getsize(tmp_path),
+                        file_size=file_size,
                         page_count=page_count,
                         status="completed",
                         schema_id=schema_id,
@@ -925,21 +1585,20 @@ async def _process_single_file(
                                 },
                                 user_token=user_token,
                             )
-                    with _stage_timer(timings_ms, "supabase_log_result"):
-                        await asyncio.to_thread(
-                            _log_extraction_result,
-                            tenant_id=tenant_id,
-                            filename=file.filename,
-                            document_id=document_row_id,
-                            schema_id=schema_id,
-                            schema_name=schema_name,
-                            field_count=field_count,
-                            processing_duration_ms=processing_duration_ms,
-                            workflow=workflow_name,
-                            status="completed",
-                            batch_id=batch_id,
-                            user_token=user_token,
-                        )
+                    _run_in_background(
+                        _log_extraction_result,
+                        tenant_id=tenant_id,
+                        filename=file.filename,
+                        document_id=document_row_id,
+                        schema_id=schema_id,
+                        schema_name=schema_name,
+                        field_count=field_count,
+                        processing_duration_ms=processing_duration_ms,
+                        workflow=workflow_name,
+                        status="completed",
+                        batch_id=batch_id,
+                        user_token=user_token,
+                    )
             
             extraction_result["source_file"] = file.filename
             
@@ -955,7 +1614,7 @@ async def _process_single_file(
             if workflow_name == "balanced" and 'vision_timings_ms' in locals() and vision_timings_ms:
                 op_metadata["vision_timings_ms"] = vision_timings_ms
 
-            timings_ms["total_file_ms"] = int((time.time() - start_time) * 1000)
+            timings_ms["total_file_ms"] = int((time.perf_counter() - start_time) * 1000)
             
             return ProcessResponse(
                 status="success",
@@ -967,12 +1626,12 @@ async def _process_single_file(
             
         except Exception as e:
             if tenant_id:
-                processing_duration_ms = int((time.time() - start_time) * 1000)
+                processing_duration_ms = int((time.perf_counter() - start_time) * 1000)
                 if defer_persistence:
                     deferred_record = DeferredPersistenceRecord(
                         tenant_id=tenant_id,
                         filename=file.filename,
-                        file_size=os.path.getsize(tmp_path) if tmp_path and os.path.exists(tmp_path) else None,
+                        file_size=file_size,
                         page_count=page_count if 'page_count' in locals() else None,
                         status="failed",
                         schema_id=schema_id,
@@ -992,7 +1651,9 @@ async def _process_single_file(
                     )
                 else:
                     if document_row_id:
-                        _update_document_row(
+                        # Fail fast: the error entry doesn't depend on the row update
+                        _run_in_background(
+                            _update_document_row,
                             document_id=document_row_id,
                             status="failed",
                             page_count=page_count if 'page_count' in locals() else None,
@@ -1004,7 +1665,8 @@ async def _process_single_file(
                             },
                             user_token=user_token,
                         )
-                    _log_extraction_result(
+                    _run_in_background(
+                        _log_extraction_result,
                         tenant_id=tenant_id,
                         filename=file.filename,
                         document_id=document_row_id,
@@ -1021,6 +1683,9 @@ async def _process_single_file(
             return None, {"filename": file.filename, "error": str(e)}, None, deferred_record
         
         finally:
+            if schema_fetch_task and not schema_fetch_task.done():
+                # Early return before the schema was needed
+                schema_fetch_task.cancel()
             if tmp_path and os.path.exists(tmp_path):
                 os.unlink(tmp_path)
 
@@ -1042,20 +1707,20 @@ async def process_batch(
     Uses leader-follower pattern: first file determines doc_type and generates system_prompt,
     then remaining files process in parallel using the pre-computed values.
     """
-    batch_start_time = time.time()
+    batch_start_time = time.perf_counter()
     batch_timings_ms: Dict[str, int] = {}
     batch_id = str(uuid.uuid4())
 
-    auth_and_quota_start_time = time.time()
-    user_id, tenant_id, user_token = _get_auth_context(authorization)
+    auth_and_quota_start_time = time.perf_counter()
+    user_id, tenant_id, user_token = await _get_auth_context(authorization)
     
     successful_results = []
     errors = []
     deferred_records: list[DeferredPersistenceRecord] = []
     
     if not files:
-        batch_timings_ms["auth_and_quota_ms"] = int((time.time() - auth_and_quota_start_time) * 1000)
-        batch_timings_ms["total_batch_ms"] = int((time.time() - batch_start_time) * 1000)
+        batch_timings_ms["auth_and_quota_ms"] = int((time.perf_counter() - auth_and_quota_start_time) * 1000)
+        batch_timings_ms["total_batch_ms"] = int((time.perf_counter() - batch_start_time) * 1000)
         return BatchProcessResponse(
             status="failed",
             batch_id=batch_id,
@@ -1066,19 +1731,38 @@ async def process_batch(
             errors=[{"filename": "N/A", "error": "No files provided"}],
         )
 
+    # Parse the inline schema once for the whole batch
+    parsed_schema_from_request: Optional[Dict[str, Any]] = None
+    if schema_content_from_request:
+        try:
+            parsed_schema_from_request = orjson.loads(schema_content_from_request)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid schema JSON: {str(e)}")
+        if not isinstance(parsed_schema_from_request, dict):
+            raise HTTPException(status_code=400, detail="Invalid schema JSON: expected an object")
+
     # Enforce per-batch total page limit before processing anything.
     total_pages = 0
     per_file_pages: list[Dict[str, Any]] = []
     pages_by_filename: Dict[str, int] = {}
     for f in files:
-        pages = _count_upload_pages(f)
+        upload_size = _get_upload_size(f)
+        if upload_size > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File '{f.filename}' exceeds maximum upload size. Size={upload_size} bytes, max={MAX_UPLOAD_BYTES}.",
+            )
+    # Off the event loop (counts may wait on PDFIUM_LOCK behind another request's
+    # loader); gather keeps the results in upload order.
+    file_pages = await asyncio.gather(*(asyncio.to_thread(_count_upload_pages, f) for f in files))
+    for f, pages in zip(files, file_pages):
         per_file_pages.append({"filename": f.filename, "pages": pages})
         pages_by_filename[f.filename] = pages
         total_pages += pages
 
     if total_pages > MAX_PAGES_PER_BATCH:
-        batch_timings_ms["auth_and_quota_ms"] = int((time.time() - auth_and_quota_start_time) * 1000)
-        batch_timings_ms["total_batch_ms"] = int((time.time() - batch_start_time) * 1000)
+        batch_timings_ms["auth_and_quota_ms"] = int((time.perf_counter() - auth_and_quota_start_time) * 1000)
+        batch_timings_ms["total_batch_ms"] = int((time.perf_counter() - batch_start_time) * 1000)
         raise HTTPException(
             status_code=413,
             detail=(
@@ -1091,31 +1775,32 @@ async def process_batch(
     # Monthly quota (per user_id): reserve pages upfront to prevent concurrent overage.
     reserved_pages = 0
     if user_id:
-        ok = _adjust_monthly_usage_pages(
+        ok = await asyncio.to_thread(
+            _adjust_monthly_usage_pages,
             user_id=user_id,
             pages_delta=total_pages,
             authorization=authorization,
             max_pages=MAX_PAGES_PER_MONTH,
         )
         if not ok:
-            batch_timings_ms["auth_and_quota_ms"] = int((time.time() - auth_and_quota_start_time) * 1000)
-            batch_timings_ms["total_batch_ms"] = int((time.time() - batch_start_time) * 1000)
+            batch_timings_ms["auth_and_quota_ms"] = int((time.perf_counter() - auth_and_quota_start_time) * 1000)
+            batch_timings_ms["total_batch_ms"] = int((time.perf_counter() - batch_start_time) * 1000)
             raise HTTPException(
                 status_code=402,
                 detail=f"Monthly quota exceeded. Max {MAX_PAGES_PER_MONTH} pages/month.",
             )
         reserved_pages = total_pages
 
-    batch_timings_ms["auth_and_quota_ms"] = int((time.time() - auth_and_quota_start_time) * 1000)
+    batch_timings_ms["auth_and_quota_ms"] = int((time.perf_counter() - auth_and_quota_start_time) * 1000)
 
     try:
         # Optimistic Parallelism: Only use if schema has been used before (has document_type).
         # If document_type exists, we have cached prompts and can process all files in parallel.
         # If document_type is None, use leader-follower to discover type from first document.
-        optimistic_context_start_time = time.time()
+        optimistic_context_start_time = time.perf_counter()
         optimistic_context = None
         if schema_id:
-            schema_details = _get_schema_details_cached(schema_id, tenant_id)
+            schema_details = await asyncio.to_thread(_get_schema_details_cached, schema_id, tenant_id)
             if schema_details and schema_details.get("content"):
                 
                 # Check if document_type exists (explicit or from schema)
@@ -1126,50 +1811,75 @@ async def process_batch(
                 if opt_doc_type:
                     opt_schema_content = schema_details.get("content")
                     
-                    # Generate system prompt once
-                    opt_system_prompt = _get_system_prompt_cached(
-                        schema_id=schema_id,
-                        document_type=opt_doc_type,
-                        schema=opt_schema_content,
-                        tenant_id=_get_prompt_cache_tenant_id(schema_id=schema_id, tenant_id=tenant_id),
-                        user_token=user_token,
-                    )
-                    
+                    # Generate system prompt once, in the background: files start
+                    # uploading and parsing meanwhile and wait for it at extraction
                     optimistic_context = BatchSharedContext(
                         doc_type=opt_doc_type,
                         schema_content=opt_schema_content,
-                        system_prompt=opt_system_prompt
+                        system_prompt_task=_start_shared_prompt(
+                            schema_id=schema_id,
+                            document_type=opt_doc_type,
+                            schema=opt_schema_content,
+                            tenant_id=tenant_id,
+                            user_token=user_token,
+                        ),
                     )
 
-        batch_timings_ms["optimistic_context_ms"] = int((time.time() - optimistic_context_start_time) * 1000)
+        elif document_type and parsed_schema_from_request:
+            # Inline schema with an explicit document_type: the leader would only
+            # re-derive what the client already sent, so skip it.
+            optimistic_context = BatchSharedContext(
+                doc_type=document_type,
+                schema_content=parsed_schema_from_request,
+                system_prompt_task=_start_shared_prompt(
+                    schema_id=None,
+                    document_type=document_type,
+                    schema=parsed_schema_from_request,
+                    tenant_id=tenant_id,
+                    user_token=user_token,
+                ),
+            )
 
-        if optimistic_context:
-            # OPTIMISTIC PATH: Launch all files in parallel immediately
+        batch_timings_ms["optimistic_context_ms"] = int((time.perf_counter() - optimistic_context_start_time) * 1000)
+
+        def _collect(result) -> None:
+            response, error, _, deferred_record = result
+            if response:
+                successful_results.append(response)
+            if error:
+                errors.append(error)
+            if deferred_record:
+                deferred_records.append(deferred_record)
+
+        async def _run_followers(follower_files: list[UploadFile], context: Optional[BatchSharedContext]) -> None:
+            # With a shared context, files reuse its doc_type/schema/prompt; without
+            # one, each file resolves them from the request like a leader would.
             follower_tasks = [
                 _process_single_file(
                     file=f,
                     batch_id=batch_id,
                     authorization=authorization,
-                    shared_context=optimistic_context,
+                    shared_context=context,
                     schema_id=schema_id,
+                    parsed_schema_from_request=None if context else parsed_schema_from_request,
+                    document_type=None if context else document_type,
                     is_leader=False,
                     defer_persistence=True,
                     tenant_id=tenant_id,
                     user_token=user_token,
                 )
-                for f in files
+                for f in follower_files
             ]
 
-            gather_start_time = time.time()
-            results = await asyncio.gather(*follower_tasks)
-            batch_timings_ms["gather_ms"] = int((time.time() - gather_start_time) * 1000)
-            for response, error, _, deferred_record in results:
-                if response:
-                    successful_results.append(response)
-                if error:
-                    errors.append(error)
-                if deferred_record:
-                    deferred_records.append(deferred_record)
+            # Process followers concurrently (bounded by BATCH_SEMAPHORE)
+            gather_start_time = time.perf_counter()
+            for result in await asyncio.gather(*follower_tasks):
+                _collect(result)
+            batch_timings_ms["gather_ms"] = int((time.perf_counter() - gather_start_time) * 1000)
+
+        if optimistic_context:
+            # OPTIMISTIC PATH: Launch all files in parallel immediately
+            await _run_followers(files, optimistic_context)
 
         else:
             # FALLBACK PATH (Leader-Follower): Process first file to discovery type
@@ -1182,95 +1892,29 @@ async def process_batch(
 
             leader_file = files[leader_idx]
             
-            leader_response, leader_error, shared_context, deferred_record = await _process_single_file(
+            leader_result = await _process_single_file(
                 file=leader_file,
                 batch_id=batch_id,
                 authorization=authorization,
                 shared_context=None,  # Leader computes its own
                 schema_id=schema_id,
-                schema_content_from_request=schema_content_from_request,
+                parsed_schema_from_request=parsed_schema_from_request,
                 document_type=document_type,
                 is_leader=True,
                 defer_persistence=True,
                 tenant_id=tenant_id,
                 user_token=user_token,
             )
+            _collect(leader_result)
+            shared_context = leader_result[2]
             
-            if leader_response:
-                successful_results.append(leader_response)
-            if leader_error:
-                errors.append(leader_error)
-
-            if deferred_record:
-                deferred_records.append(deferred_record)
-            
-            # Step 2: Process FOLLOWERS in parallel using shared context from leader
+            # Step 2: Process FOLLOWERS in parallel, reusing the leader's context when it
+            # produced one, otherwise independently
             follower_files = [f for i, f in enumerate(files) if i != leader_idx]
+            if follower_files:
+                await _run_followers(follower_files, shared_context)
 
-            if len(follower_files) > 0 and shared_context:
-                
-                follower_tasks = [
-                    _process_single_file(
-                        file=f,
-                        batch_id=batch_id,
-                        authorization=authorization,
-                        shared_context=shared_context,  # Reuse leader's computed values
-                        schema_id=schema_id,
-                        is_leader=False,
-                        defer_persistence=True,
-                        tenant_id=tenant_id,
-                        user_token=user_token,
-                    )
-                    for f in follower_files
-                ]
-
-                # Process followers concurrently with semaphore limiting to 5
-                gather_start_time = time.time()
-                follower_results = await asyncio.gather(*follower_tasks)
-                batch_timings_ms["gather_ms"] = int((time.time() - gather_start_time) * 1000)
-                
-                for response, error, _, deferred_record in follower_results:
-                    if response:
-                        successful_results.append(response)
-                    if error:
-                        errors.append(error)
-                    if deferred_record:
-                        deferred_records.append(deferred_record)
-        
-            elif len(follower_files) > 0 and not shared_context:
-                # Leader failed to produce shared context, process followers independently
-                
-                follower_tasks = [
-                    _process_single_file(
-                        file=f,
-                        batch_id=batch_id,
-                        authorization=authorization,
-                        shared_context=None,
-                        schema_id=schema_id,
-                        schema_content_from_request=schema_content_from_request,
-                        document_type=document_type,
-                        is_leader=False,
-                        defer_persistence=True,
-                        tenant_id=tenant_id,
-                        user_token=user_token,
-                    )
-                    for f in follower_files
-                ]
-
-                # Process followers concurrently with semaphore limiting to 5
-                gather_start_time = time.time()
-                follower_results = await asyncio.gather(*follower_tasks)
-                batch_timings_ms["gather_ms"] = int((time.time() - gather_start_time) * 1000)
-                
-                for response, error, _, deferred_record in follower_results:
-                    if response:
-                        successful_results.append(response)
-                    if error:
-                        errors.append(error)
-                    if deferred_record:
-                        deferred_records.append(deferred_record)
-
-        batch_timings_ms["total_batch_ms"] = int((time.time() - batch_start_time) * 1000)
+        batch_timings_ms["total_batch_ms"] = int((time.perf_counter() - batch_start_time) * 1000)
 
         if deferred_records and background_tasks is not None:
             background_tasks.add_task(_persist_deferred_records, deferred_records)
@@ -1301,7 +1945,9 @@ async def process_batch(
             )
             refund_pages = max(reserved_pages - successful_pages, 0)
             if refund_pages:
-                _adjust_monthly_usage_pages(
+                # The response doesn't depend on the refund, so don't wait for it
+                _run_in_background(
+                    _adjust_monthly_usage_pages,
                     user_id=user_id,
                     pages_delta=-refund_pages,
                     authorization=authorization,
@@ -1318,15 +1964,12 @@ async def delete_schema_endpoint(
     Delete a schema and its corresponding prompt cache entry.
     Requires authentication.
     """
-    user_id = _get_user_id_from_token_cached(authorization)
+    user_id = await asyncio.to_thread(_get_user_id_from_token_cached, authorization)
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
-        
-    from utils.supabase_schemas import delete_schema
-    from utils.prompt_generator import calculate_prompt_cache_key, delete_prompt_from_cache
-    
+
     # 1. Fetch schema details to calculate cache key
-    schema_details = get_schema_details(schema_id)
+    schema_details = await asyncio.to_thread(get_schema_details, schema_id)
     if not schema_details:
         raise HTTPException(status_code=404, detail="Schema not found")
         
@@ -1343,7 +1986,7 @@ async def delete_schema_endpoint(
         # Ensure schema_content is a dict
         if isinstance(schema_content, str):
             try:
-                schema_content = json.loads(schema_content)
+                schema_content = orjson.loads(schema_content)
             except:
                 pass
                 
@@ -1351,14 +1994,16 @@ async def delete_schema_endpoint(
              cache_key, _ = calculate_prompt_cache_key(document_type, schema_content)
     
     # 3. Delete Schema
-    deleted = delete_schema(schema_id)
+    deleted = await asyncio.to_thread(delete_schema, schema_id)
     if not deleted:
         raise HTTPException(status_code=500, detail="Failed to delete schema")
+    _SCHEMA_DETAILS_CACHE.pop(schema_id)
+    _SCHEMA_CONTENT_CACHE.pop(schema_id)
         
     # 4. Delete Prompt Cache (if key was calculated)
     prompt_deleted = False
     if cache_key:
-        prompt_deleted = delete_prompt_from_cache(cache_key)
+        prompt_deleted = await asyncio.to_thread(delete_prompt_from_cache, cache_key)
         
     return {
         "status": "success", 
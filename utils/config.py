@@ -0,0 +1,13 @@
+"""Supabase settings shared by the API and the utils helpers, read once at import."""
+import os
+
+from dotenv import load_dotenv
+
+# Load .env before reading anything, so helpers imported standalone (scripts) see it too
+load_dotenv()
+
+# Normalised without a trailing slash so endpoint URLs can be joined with "/rest/v1/..."
+SUPABASE_URL = (os.getenv("VITE_SUPABASE_URL") or "").rstrip("/") or None
+SUPABASE_ANON_KEY = os.getenv("VITE_SUPABASE_ANON_KEY") or None
+# Backend-only operations use the service role key (bypasses RLS) when it is set
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or SUPABASE_ANON_KEY
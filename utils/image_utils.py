@@ -5,6 +5,8 @@ from typing import List
 import pdfplumber
 from PIL import Image
 
+from utils.pdfium_lock import PDFIUM_LOCK
+
 def convert_pdf_to_images(pdf_path: str) -> List[str]:
     """
     Convert PDF pages to base64 encoded JPEG images.
@@ -20,7 +22,9 @@ def convert_pdf_to_images(pdf_path: str) -> List[str]:
             for page in pages:
                 # Convert page to image with reasonable resolution
                 # resolution=300 is good for OCR/Vision
-                im = page.to_image(resolution=resolution).original
+                # pdfplumber renders through PDFium, which is not thread-safe
+                with PDFIUM_LOCK:
+                    im = page.to_image(resolution=resolution).original
                 
                 # Convert PIL Image to base64
                 buffered = io.BytesIO()
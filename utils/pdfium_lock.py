@@ -0,0 +1,5 @@
+import threading
+
+# PDFium is not thread-safe, even across documents. Every call into it, whether
+# direct through pypdfium2 or via pdfplumber's page rendering, must hold this lock.
+PDFIUM_LOCK = threading.Lock()
@@ -1,21 +1,44 @@
 from typing import Dict, Any, Optional
 import json
 import hashlib
-import os
 from pathlib import Path
+import orjson
+import requests
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
+from utils.config import SUPABASE_URL, SUPABASE_ANON_KEY
+
 # Local cache directory (fallback for testing without Supabase)
 LOCAL_PROMPT_CACHE_DIR = Path(__file__).parent.parent / ".prompt_cache"
 
+PROMPT_CACHE_URL = f"{SUPABASE_URL}/rest/v1/prompt_cache" if SUPABASE_URL else None
+
+# Shared LLM client so its HTTP connection pool is reused across calls
+_prompt_llm = None
+
 class SystemPromptOutput(BaseModel):
     system_prompt: str = Field(..., description="The generated system prompt for the extraction task.")
 
 
+def _get_prompt_llm():
+    """Return the shared structured-output LLM used for prompt generation."""
+    global _prompt_llm
+    if _prompt_llm is None:
+        _prompt_llm = ChatOpenAI(model="gpt-4o", temperature=0).with_structured_output(
+            SystemPromptOutput, method="function_calling"
+        )
+    return _prompt_llm
+
+
+def warm_up_prompt_generator() -> None:
+    """Build the shared LLM client ahead of the first request (no API call is made)."""
+    _get_prompt_llm()
+
+
 def _get_supabase_headers(user_token: Optional[str] = None) -> Dict[str, str]:
     """Get Supabase API headers."""
-    supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY", "")
+    supabase_key = SUPABASE_ANON_KEY or ""
     auth_token = user_token if user_token else supabase_key
     return {
         "apikey": supabase_key,
@@ -35,12 +58,10 @@ def _get_cached_prompt_from_supabase(
 ) -> Optional[str]:
     """Fetch cached prompt from Supabase prompt_cache table."""
     try:
-        import requests
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        if not supabase_url:
+        if not SUPABASE_URL:
             return None
         
-        url = f"{supabase_url.rstrip('/')}/rest/v1/prompt_cache"
+        url = PROMPT_CACHE_URL
 
         params: Dict[str, str] = {
             "select": "system_prompt,created_at",
@@ -82,12 +103,10 @@ def _save_prompt_to_supabase(
 ) -> bool:
     """Save generated prompt to Supabase prompt_cache table."""
     try:
-        import requests
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        if not supabase_url:
+        if not SUPABASE_URL:
             return False
         
-        url = f"{supabase_url.rstrip('/')}/rest/v1/prompt_cache"
+        url = PROMPT_CACHE_URL
 
         payload: Dict[str, Any] = {
             "cache_key": cache_key,
@@ -102,7 +121,7 @@ def _save_prompt_to_supabase(
         if schema_id:
             payload["schema_id"] = schema_id
         
-        resp = requests.post(url, headers=_get_supabase_headers(user_token), json=payload, timeout=5)
+        resp = requests.post(url, headers=_get_supabase_headers(user_token), data=orjson.dumps(payload), timeout=5)
         if resp.status_code == 409:
             return True
 
@@ -115,12 +134,10 @@ def _save_prompt_to_supabase(
 def delete_prompt_from_cache(cache_key: str) -> bool:
     """Delete a prompt from the Supabase prompt_cache table."""
     try:
-        import requests
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        if not supabase_url:
+        if not SUPABASE_URL:
             return False
         
-        url = f"{supabase_url.rstrip('/')}/rest/v1/prompt_cache"
+        url = PROMPT_CACHE_URL
         params = {"cache_key": f"eq.{cache_key}"}
         
         print(f"[Prompt Generator] Deleting prompt cache for key: {cache_key}")
@@ -232,9 +249,7 @@ def generate_system_prompt(
     )
 
 
-    llm = ChatOpenAI(model="gpt-4o", temperature=0).with_structured_output(
-        SystemPromptOutput, method="function_calling"
-    )
+    llm = _get_prompt_llm()
 
     try:
         print(f"[Prompt Generator] Generating new prompt for '{document_type}' (not in cache)")
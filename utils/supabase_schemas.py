@@ -1,30 +1,29 @@
-import os
-import json
+import orjson
+import requests
 from typing import Dict, Any, Optional
 
+from utils.config import SUPABASE_URL, SUPABASE_SERVICE_KEY as SUPABASE_KEY
+
+SCHEMAS_URL = f"{SUPABASE_URL}/rest/v1/schemas" if SUPABASE_URL else None
+
 def get_schema_content(schema_id: str) -> Dict[str, Any]:
     """Fetch schema content from Supabase using service role key to bypass RLS."""
     try:
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        # Use service role key for backend operations (bypasses RLS)
-        supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("VITE_SUPABASE_ANON_KEY")
-        
-        if not supabase_url or not supabase_key:
+        if not SUPABASE_URL or not SUPABASE_KEY:
             print(f"[Schema] Missing Supabase credentials")
             raise ValueError("Supabase credentials not configured")
-            
-        import requests
-        url = f"{supabase_url.rstrip('/')}/rest/v1/schemas?id=eq.{schema_id}"
+
+        url = f"{SCHEMAS_URL}?id=eq.{schema_id}"
         headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
         }
         
         print(f"[Schema] Fetching schema {schema_id}")
         resp = requests.get(url, headers=headers, params={"select": "content"}, timeout=5)
         print(f"[Schema] Response status: {resp.status_code}, body: {resp.text[:500] if resp.text else 'empty'}")
         resp.raise_for_status()
-        data = resp.json()
+        data = orjson.loads(resp.content)
         if not data:
             print(f"[Schema] No schema found for id={schema_id} (empty array returned)")
             return {"fields": []}
@@ -36,8 +35,8 @@ def get_schema_content(schema_id: str) -> Dict[str, Any]:
         # receive a string. Normalize to dict to avoid empty-field extractions.
         if isinstance(content, str):
             try:
-                content = json.loads(content)
-            except json.JSONDecodeError:
+                content = orjson.loads(content)
+            except orjson.JSONDecodeError:
                 print(f"[Schema] Failed to parse content as JSON")
                 return {"fields": []}
 
@@ -65,17 +64,11 @@ def get_schema_details(schema_id: str, tenant_id: Optional[str] = None) -> Optio
         Schema details if found and accessible, None otherwise
     """
     try:
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        # Use service role key for backend operations (bypasses RLS)
-        supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("VITE_SUPABASE_ANON_KEY")
-        
-        if not supabase_url or not supabase_key:
+        if not SUPABASE_URL or not SUPABASE_KEY:
             return None
-            
-        import requests
-        
+
         # Build query: allow global templates (tenant_id IS NULL) or tenant-owned schemas
-        url = f"{supabase_url.rstrip('/')}/rest/v1/schemas?id=eq.{schema_id}"
+        url = f"{SCHEMAS_URL}?id=eq.{schema_id}"
         if tenant_id:
             url += f"&or=(tenant_id.is.null,tenant_id.eq.{tenant_id})"
         else:
@@ -83,8 +76,8 @@ def get_schema_details(schema_id: str, tenant_id: Optional[str] = None) -> Optio
             url += "&tenant_id=is.null"
         
         headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
         }
         
         resp = requests.get(
@@ -94,7 +87,7 @@ def get_schema_details(schema_id: str, tenant_id: Optional[str] = None) -> Optio
             timeout=5,
         )
         if resp.ok:
-            data = resp.json()
+            data = orjson.loads(resp.content)
             if data:
                 return data[0]
         return None
@@ -107,18 +100,13 @@ def get_schema_details(schema_id: str, tenant_id: Optional[str] = None) -> Optio
 def delete_schema(schema_id: str) -> bool:
     """Delete a schema from the Supabase schemas table."""
     try:
-        supabase_url = os.getenv("VITE_SUPABASE_URL")
-        # Use service role key for backend operations (bypasses RLS)
-        supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("VITE_SUPABASE_ANON_KEY")
-        
-        if not supabase_url or not supabase_key:
+        if not SUPABASE_URL or not SUPABASE_KEY:
             return False
-            
-        import requests
-        url = f"{supabase_url.rstrip('/')}/rest/v1/schemas?id=eq.{schema_id}"
+
+        url = f"{SCHEMAS_URL}?id=eq.{schema_id}"
         headers = {
-            "apikey": supabase_key,
-            "Authorization": f"Bearer {supabase_key}",
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
         }
         
         print(f"[Schema] Deleting schema {schema_id}")